@@ -93,14 +93,15 @@ def greedy_partition(items: list[CLIPTokens], max_sum: int) -> list[list[CLIPTok
     return bags
 
 
-def encode_bag_of_subprompts_greedy(
+def compose_greedy_bags(
     prefixes: list[str],
     suffixes: list[str],
     tokenize_func: TokenizeFunc,
-    encode_func: EncodeFunc,
     logger: logging.Logger | None = None,
-) -> EncoderOutput:
-    """
+) -> list[CLIPTokens]:
+    """Tokenize prefixes/suffixes and greedily merge them into 77-token
+    targets, without encoding them.
+
     Note: tokenize_func is expected to clamp the tokens to 75 tokens.
     """
     if logger is None:
@@ -122,11 +123,27 @@ def encode_bag_of_subprompts_greedy(
 
     # Then merge prefix and suffix tokens
     suffix_targets = greedy_partition(suffix_targets, max_sum=allowed_suffix_length)
-    targets = [
+    return [
         sum([prefix_tokens, *b], CLIPTokens.empty_tokens()).clamp_to_77_tokens()
         for b in suffix_targets
     ]
 
+
+def encode_bag_of_subprompts_greedy(
+    prefixes: list[str],
+    suffixes: list[str],
+    tokenize_func: TokenizeFunc,
+    encode_func: EncodeFunc,
+    logger: logging.Logger | None = None,
+) -> EncoderOutput:
+    """
+    Note: tokenize_func is expected to clamp the tokens to 75 tokens.
+    """
+    if logger is None:
+        logger = logging.getLogger(__name__)
+
+    targets = compose_greedy_bags(prefixes, suffixes, tokenize_func, logger)
+
     # Encode!
     encoded_embeds = [encode_func(target) for target in targets]
     conds_merged = torch.concat([embed.cond for embed in encoded_embeds], dim=1)
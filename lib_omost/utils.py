@@ -1,3 +1,4 @@
+from __future__ import annotations
 from contextlib import contextmanager
 
 import torch
@@ -5,16 +6,24 @@ import numpy as np
 
 
 @torch.inference_mode()
-def numpy2pytorch(imgs: list[np.ndarray]):
+def numpy2pytorch(imgs: list[np.ndarray], device: torch.device | None = None):
     """Convert a list of numpy images to a pytorch tensor.
     Input: images in list[[H, W, C]] format.
     Output: images in [B, H, W, C] format.
 
+    When CUDA is available the tensor is allocated in pinned memory, so a
+    later transfer to the GPU can overlap with compute. Pass `device` to
+    perform that transfer here with a non-blocking copy.
+
     Note: ComfyUI expects [B, H, W, C] format instead of [B, C, H, W] format.
     """
     assert len(imgs) > 0
     assert all(img.ndim == 3 for img in imgs)
     h = torch.from_numpy(np.stack(imgs, axis=0)).float() / 255.0
+    if torch.cuda.is_available():
+        h = h.pin_memory()
+    if device is not None:
+        h = h.to(device, non_blocking=True)
     return h
 
 
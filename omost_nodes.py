@@ -1,6 +1,9 @@
 from __future__ import annotations
+from collections import OrderedDict
 from enum import Enum
+import functools
 import json
+import threading
 from typing import Literal, Tuple, TypedDict, NamedTuple
 import sys
 import os
@@ -10,12 +13,19 @@ from typing_extensions import NotRequired
 import requests
 from openai import OpenAI
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
 
 import comfy.model_management
 from comfy.model_patcher import ModelPatcher
 from comfy.sd import CLIP
-from nodes import CLIPTextEncode, ConditioningSetMask
+from nodes import CLIPTextEncode
 from .lib_omost.canvas import (
     Canvas as OmostCanvas,
     OmostCanvasCondition,
@@ -23,7 +33,7 @@ from .lib_omost.canvas import (
 )
 from .lib_omost.utils import numpy2pytorch, scoped_numpy_random, scoped_torch_random
 from .lib_omost.greedy_encode import (
-    encode_bag_of_subprompts_greedy,
+    compose_greedy_bags,
     CLIPTokens,
     EncoderOutput,
     SPECIAL_TOKENS,
@@ -79,6 +89,81 @@ class ComfyCLIPTokens(TypedDict):
 # End of type definitions.
 
 
+_load_llm_lock = threading.Lock()
+
+
+def _maybe_compile_llm(llm_model: AutoModelForCausalLM) -> None:
+    """Compile the LLM forward once per model to cut decode-step kernel
+    launch overhead. A static KV cache would compose badly with the
+    cross-turn DynamicCache reuse in OmostLLMChatNode, so the cache stays
+    dynamic and compilation uses dynamic shapes."""
+    # Flag the model object itself; an id()-keyed set could wrongly skip a
+    # new model whose id recycles an evicted one's.
+    if getattr(llm_model, "_omost_compile_attempted", False):
+        return
+    llm_model._omost_compile_attempted = True
+
+    if not torch.cuda.is_available():
+        return
+    eager_forward = llm_model.forward
+    try:
+        llm_model.forward = torch.compile(llm_model.forward, dynamic=True)
+        # Dynamo only traces on the first call, so run a warmup forward here:
+        # compile failures surface now and fall back to eager instead of
+        # blowing up inside generate.
+        warmup_token = llm_model.config.bos_token_id or 0
+        with torch.inference_mode():
+            llm_model.forward(
+                input_ids=torch.tensor([[warmup_token]], device=llm_model.device)
+            )
+    except Exception:
+        llm_model.forward = eager_forward
+        logger.warning("torch.compile on LLM failed; running eager.", exc_info=True)
+
+
+@functools.lru_cache(maxsize=2)
+def _load_llm(llm_name: str, quant: str = "auto") -> OmostLLM:
+    """Load LLM model. Cached so that re-running a workflow reuses the
+    already-loaded model instead of paying the multi-GB load again.
+
+    quant="auto" loads the checkpoint with whatever quantization is baked
+    into its config. quant="nf4" loads the unquantized base checkpoint
+    (dropping the -8bits/-4bits name suffix) and quantizes it to NF4 on the
+    fly, which halves weight VRAM relative to the 8-bit checkpoints. A
+    BitsAndBytesConfig cannot simply be passed for the pre-quantized
+    checkpoints: transformers keeps the config baked into the model."""
+    HF_TOKEN = None
+    dtype = (
+        torch.float16 if comfy.model_management.should_use_fp16() else torch.float32
+    )
+
+    quantization_config = None
+    if quant == "nf4":
+        from transformers import BitsAndBytesConfig
+
+        for suffix in ("-8bits", "-4bits"):
+            if llm_name.endswith(suffix):
+                llm_name = llm_name[: -len(suffix)]
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=dtype,
+            bnb_4bit_use_double_quant=True,
+        )
+
+    llm_model = AutoModelForCausalLM.from_pretrained(
+        llm_name,
+        torch_dtype=dtype,  # This is computation type, not load/memory type. The loading quant type is baked in config.
+        token=HF_TOKEN,
+        device_map="auto",  # This will load model to gpu with an offload system
+        trust_remote_code=True,
+        quantization_config=quantization_config,
+    )
+    llm_tokenizer = AutoTokenizer.from_pretrained(llm_name, token=HF_TOKEN)
+
+    return OmostLLM(llm_model, llm_tokenizer)
+
+
 class OmostLLMLoaderNode:
     @classmethod
     def INPUT_TYPES(s):
@@ -94,6 +179,10 @@ class OmostLLMLoaderNode:
                         "default": "lllyasviel/omost-llama-3-8b-4bits",
                     },
                 ),
+                "quant": (
+                    ["auto", "nf4"],
+                    {"default": "auto"},
+                ),
             }
         }
 
@@ -101,23 +190,12 @@ class OmostLLMLoaderNode:
     FUNCTION = "load_llm"
     CATEGORY = "omost"
 
-    def load_llm(self, llm_name: str) -> Tuple[OmostLLM]:
+    def load_llm(self, llm_name: str, quant: str = "auto") -> Tuple[OmostLLM]:
         """Load LLM model"""
-        HF_TOKEN = None
-        dtype = (
-            torch.float16 if comfy.model_management.should_use_fp16() else torch.float32
-        )
-
-        llm_model = AutoModelForCausalLM.from_pretrained(
-            llm_name,
-            torch_dtype=dtype,  # This is computation type, not load/memory type. The loading quant type is baked in config.
-            token=HF_TOKEN,
-            device_map="auto",  # This will load model to gpu with an offload system
-            trust_remote_code=True,
-        )
-        llm_tokenizer = AutoTokenizer.from_pretrained(llm_name, token=HF_TOKEN)
-
-        return (OmostLLM(llm_model, llm_tokenizer),)
+        # Lock so concurrent graph executions cannot double-load the weights
+        # before the lru_cache entry is populated.
+        with _load_llm_lock:
+            return (_load_llm(llm_name, quant),)
 
 
 class OmostLLMHTTPServerNode:
@@ -169,6 +247,48 @@ class OmostLLMHTTPServerNode:
         return (OmostLLMServer(client, model_id),)
 
 
+class CanvasEndStoppingCriteria(StoppingCriteria):
+    """Stop generation once the canvas code block is closed.
+
+    The only part of the response that matters downstream is the fenced
+    python block, so generation can end at the closing fence instead of
+    running until EOS or max_new_tokens. Fence detection runs on the
+    streamer consumer thread via `feed`, which already sees the decoded
+    text; the criteria itself only polls an event, keeping all tokenizer
+    work off the generation loop."""
+
+    def __init__(self):
+        self.stop_event = threading.Event()
+        self._fence_count = 0
+        self._tail = ""
+
+    def feed(self, text_piece: str) -> None:
+        """Scan a streamed text piece for code fences. Called from the
+        streamer consumer thread."""
+        # Count fences non-overlapping across the whole stream: scan the
+        # carried tail plus the new piece, consume three backticks per
+        # fence, and carry at most the last two unconsumed characters. A
+        # fence split across pieces is still seen, while backticks already
+        # consumed by a counted fence are never recounted.
+        text = self._tail + text_piece
+        pos = 0
+        while True:
+            idx = text.find("```", pos)
+            if idx == -1:
+                break
+            self._fence_count += 1
+            pos = idx + 3
+        self._tail = text[max(pos, len(text) - 2) :]
+        # Opening ```python fence plus closing ``` fence.
+        if self._fence_count >= 2:
+            self.stop_event.set()
+
+    def __call__(
+        self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs
+    ) -> bool:
+        return self.stop_event.is_set()
+
+
 class OmostLLMChatNode:
     @classmethod
     def INPUT_TYPES(s):
@@ -203,6 +323,65 @@ class OmostLLMChatNode:
     FUNCTION = "run_llm"
     CATEGORY = "omost"
 
+    # Per-model LRU cache of KV states keyed on conversation prefix, so that
+    # multi-turn chats only need to prefill the newly appended user turn
+    # instead of the whole conversation. The cache hangs off the model
+    # object itself: it is dropped together with the model, and a new model
+    # at a recycled id() can never hit another model's entries. Note the
+    # entries hold GPU tensors, so up to KV_CACHE_SIZE full conversations
+    # stay resident per model until evicted.
+    KV_CACHE_SIZE = 8
+
+    @staticmethod
+    def _model_kv_cache(
+        llm_model: AutoModelForCausalLM,
+    ) -> OrderedDict[int, Tuple[torch.Tensor, DynamicCache]]:
+        kv_cache = getattr(llm_model, "_omost_kv_cache", None)
+        if kv_cache is None:
+            kv_cache = OrderedDict()
+            llm_model._omost_kv_cache = kv_cache
+        return kv_cache
+
+    @staticmethod
+    def _conversation_hash(conversation: OmostConversation) -> int:
+        return hash(tuple((item["role"], item["content"]) for item in conversation))
+
+    @staticmethod
+    def _strip_bos(ids: torch.Tensor, tokenizer: AutoTokenizer) -> torch.Tensor:
+        if (
+            tokenizer.bos_token_id is not None
+            and ids[0, 0].item() == tokenizer.bos_token_id
+        ):
+            ids = ids[:, 1:]
+        return ids
+
+    @staticmethod
+    def _system_prompt_ids(tokenizer: AutoTokenizer) -> torch.Tensor:
+        # The system prompt never changes, so it only needs to go through
+        # the chat template once per tokenizer. The ids are attached to the
+        # tokenizer object itself so they are dropped with it and a new
+        # tokenizer at a recycled id() can never see another's ids.
+        ids = getattr(tokenizer, "_omost_system_ids", None)
+        if ids is None:
+            ids = tokenizer.apply_chat_template(
+                [{"role": "system", "content": system_prompt}], return_tensors="pt"
+            )
+            tokenizer._omost_system_ids = ids
+        return ids
+
+    @classmethod
+    def _store_kv_cache(
+        cls,
+        kv_cache: OrderedDict[int, Tuple[torch.Tensor, DynamicCache]],
+        key: int,
+        prefix_ids: torch.Tensor,
+        cache: DynamicCache,
+    ) -> None:
+        kv_cache[key] = (prefix_ids, cache)
+        kv_cache.move_to_end(key)
+        while len(kv_cache) > cls.KV_CACHE_SIZE:
+            kv_cache.popitem(last=False)
+
     def prepare_conversation(
         self, text: str, conversation: OmostConversation | None = None
     ) -> Tuple[OmostConversation, OmostConversation, OmostConversationItem]:
@@ -234,26 +413,114 @@ class OmostLLMChatNode:
         with scoped_torch_random(seed), scoped_numpy_random(seed):
             llm_tokenizer: AutoTokenizer = llm.tokenizer
             llm_model: AutoModelForCausalLM = llm.model
+            _maybe_compile_llm(llm_model)
 
-            input_ids: torch.Tensor = llm_tokenizer.apply_chat_template(
-                input_conversation, return_tensors="pt", add_generation_prompt=True
-            ).to(llm_model.device)
-            input_length = input_ids.shape[1]
-
-            output_ids: torch.Tensor = llm_model.generate(
-                input_ids=input_ids,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=temperature != 0,
+            # Pop instead of get: generate mutates the DynamicCache in place,
+            # invalidating the entry for its old prefix.
+            kv_cache = self._model_kv_cache(llm_model)
+            cached = kv_cache.pop(
+                self._conversation_hash(input_conversation[:-1]), None
             )
-            generated_ids = output_ids[:, input_length:]
-            generated_text: str = llm_tokenizer.decode(
-                generated_ids[0],
-                skip_special_tokens=True,
-                skip_prompt=True,
-                timeout=10,
+            past_key_values: DynamicCache | None = None
+            if cached is not None:
+                prefix_ids, past_key_values = cached
+                delta_ids: torch.Tensor = self._strip_bos(
+                    llm_tokenizer.apply_chat_template(
+                        [input_conversation[-1]],
+                        return_tensors="pt",
+                        add_generation_prompt=True,
+                    ),
+                    llm_tokenizer,
+                ).to(llm_model.device)
+                input_ids = torch.cat([prefix_ids, delta_ids], dim=1)
+            else:
+                # input_conversation always starts with the system prompt;
+                # reuse its precomputed ids and tokenize only the rest.
+                rest_ids: torch.Tensor = self._strip_bos(
+                    llm_tokenizer.apply_chat_template(
+                        input_conversation[1:],
+                        return_tensors="pt",
+                        add_generation_prompt=True,
+                    ),
+                    llm_tokenizer,
+                )
+                input_ids: torch.Tensor = torch.cat(
+                    [self._system_prompt_ids(llm_tokenizer), rest_ids], dim=1
+                ).to(llm_model.device)
+            generate_kwargs = {
+                # Silence the per-call "Setting pad_token_id to eos_token_id"
+                # warning; batch size is 1 so padding is never used.
+                "pad_token_id": llm_tokenizer.eos_token_id,
+            }
+            if past_key_values is not None:
+                generate_kwargs["past_key_values"] = past_key_values
+            if temperature == 0:
+                # Greedy fast-path: plain argmax decode without the sampling
+                # logits processors (and without transformers warning about
+                # unused temperature/top_p).
+                generate_kwargs["do_sample"] = False
+            else:
+                generate_kwargs.update(
+                    do_sample=True, temperature=temperature, top_p=top_p
+                )
+            streamer = TextIteratorStreamer(
+                llm_tokenizer, skip_prompt=True, skip_special_tokens=True
             )
+            canvas_end_criteria = CanvasEndStoppingCriteria()
+            generate_result: dict = {}
+
+            def generate_worker():
+                try:
+                    generate_result["output"] = llm_model.generate(
+                        input_ids=input_ids,
+                        max_new_tokens=max_new_tokens,
+                        use_cache=True,
+                        return_dict_in_generate=True,
+                        stopping_criteria=StoppingCriteriaList(
+                            [canvas_end_criteria]
+                        ),
+                        streamer=streamer,
+                        **generate_kwargs,
+                    )
+                except BaseException as e:
+                    generate_result["error"] = e
+                    streamer.end()
+
+            worker = threading.Thread(target=generate_worker, daemon=True)
+            worker.start()
+            # Consume the stream as tokens arrive: text assembly overlaps with
+            # GPU decode and no separate full decode pass is needed at the
+            # end.
+            pieces: list[str] = []
+            for piece in streamer:
+                pieces.append(piece)
+                canvas_end_criteria.feed(piece)
+            worker.join()
+            if "error" in generate_result:
+                raise generate_result["error"]
+            output = generate_result["output"]
+            output_ids: torch.Tensor = output.sequences
+            generated_text: str = "".join(pieces)
+
+            if (
+                isinstance(output.past_key_values, DynamicCache)
+                and not canvas_end_criteria.stop_event.is_set()
+            ):
+                # The cache now covers the assistant reply as well, so key it
+                # on the conversation prefix the next turn will present.
+                # When the fence criteria cut generation short, the sequence
+                # ends mid-assistant-turn without an end-of-turn token and
+                # would diverge from the chat-template rendering, so such
+                # prefixes are not stored.
+                self._store_kv_cache(
+                    kv_cache,
+                    self._conversation_hash(
+                        input_conversation
+                        + [{"role": "assistant", "content": generated_text}]
+                    ),
+                    output_ids,
+                    output.past_key_values,
+                )
             return generated_text
 
     def run_llm(
@@ -341,26 +608,47 @@ class PromptEncoding:
     ) -> ComfyUIConditioning:
         """@Deprecated
         Simplified way to encode bag of subprompts without omost's greedy approach.
+        The shared prefix is encoded once instead of being re-encoded as part
+        of every suffix prompt; prefix and suffix embeddings are then joined
+        with a single concat along the sequence dim.
         """
-        conds: ComfyUIConditioning = []
-
         logger.debug("Start encoding bag of subprompts")
+        prefix_prompt = "".join(prefixes)
+        logger.debug(f"Encoding prefix: {prefix_prompt}")
+        prefix_cond: ComfyUIConditioning = PromptEncoding.ENCODE_NODE.encode(
+            clip, prefix_prompt
+        )[0]
+        assert len(prefix_cond) == 1
+
+        conds: ComfyUIConditioning = []
         for target in suffixes:
-            complete_prompt = "".join(prefixes + [target])
-            logger.debug(f"Encoding prompt: {complete_prompt}")
+            logger.debug(f"Encoding suffix: {target}")
             cond: ComfyUIConditioning = PromptEncoding.ENCODE_NODE.encode(
-                clip, complete_prompt
+                clip, target
             )[0]
             assert len(cond) == 1
             conds.extend(cond)
 
         logger.debug("End encoding bag of subprompts. Total conditions: %d", len(conds))
 
-        # Concat all conditions
+        # Merge all conditions into one preallocated tensor: each encoder
+        # result is written into its slice directly instead of materializing
+        # an intermediate list for torch.cat.
+        parts = [prefix_cond[0][0]] + [cond for cond, _ in conds]
+        merged = torch.empty(
+            [1, sum(part.shape[1] for part in parts), parts[0].shape[2]],
+            dtype=parts[0].dtype,
+            device=parts[0].device,
+        )
+        offset = 0
+        for part in parts:
+            merged[:, offset : offset + part.shape[1]] = part
+            offset += part.shape[1]
+
         return [
             [
                 # cond
-                torch.cat([cond for cond, _ in conds], dim=1),
+                merged,
                 # extra_dict
                 {"pooled_output": conds[0][1]["pooled_output"]},
             ]
@@ -384,10 +672,19 @@ class PromptEncoding:
 
     @staticmethod
     def encode_bag_of_subprompts_greedy(
-        clip: CLIP, prefixes: list[str], suffixes: list[str]
+        clip: CLIP,
+        prefixes: list[str],
+        suffixes: list[str],
+        encode_cache: dict[tuple, EncoderOutput] | None = None,
     ) -> ComfyUIConditioning:
         """Encode bag of subprompts with greedy approach. This approach is used
-        by the original Omost repo."""
+        by the original Omost repo.
+
+        `encode_cache` memoizes encoder outputs keyed on the final token
+        sequence, so identical prefix/suffix bags recurring across regions
+        share one CLIP forward pass. Cached entries for non-first bags carry
+        no pooler (a batched encode only yields the first section's pooled
+        output)."""
 
         def convert_comfy_tokens(
             comfy_tokens: list[ComfyCLIPTokensWithWeight],
@@ -398,16 +695,6 @@ class PromptEncoding:
             # Strip padding tokens.
             return tokens[1 : tokens.index(SPECIAL_TOKENS["end"])]
 
-        def convert_to_comfy_tokens(tokens: CLIPTokens) -> ComfyCLIPTokens:
-            return {
-                "l": [[(token, 1.0) for token in tokens.clip_l_tokens]],
-                "g": (
-                    [[(token, 1.0) for token in tokens.clip_g_tokens]]
-                    if tokens.clip_g_tokens is not None
-                    else None
-                ),
-            }
-
         def tokenize(text: str) -> CLIPTokens:
             tokens: ComfyCLIPTokens = clip.tokenize(text)
             return CLIPTokens(
@@ -417,24 +704,61 @@ class PromptEncoding:
                 ),
             )
 
-        def encode(tokens: CLIPTokens) -> EncoderOutput:
-            cond, pooled = clip.encode_from_tokens(
-                convert_to_comfy_tokens(tokens), return_pooled=True
+        def target_key(tokens: CLIPTokens) -> tuple:
+            return (
+                tuple(tokens.clip_l_tokens),
+                (
+                    tuple(tokens.clip_g_tokens)
+                    if tokens.clip_g_tokens is not None
+                    else None
+                ),
             )
-            return EncoderOutput(cond=cond, pooler=pooled)
-
-        encoder_output = encode_bag_of_subprompts_greedy(
-            prefixes,
-            suffixes,
-            tokenize_func=tokenize,
-            encode_func=encode,
-            logger=logger,
+
+        targets: list[CLIPTokens] = compose_greedy_bags(
+            prefixes, suffixes, tokenize_func=tokenize, logger=logger
         )
+        cached: list[EncoderOutput | None] = [
+            encode_cache.get(target_key(target)) if encode_cache is not None else None
+            for target in targets
+        ]
 
+        if (
+            len(cached) > 0
+            and all(c is not None for c in cached)
+            and cached[0].pooler is not None
+        ):
+            cond = torch.cat([c.cond for c in cached], dim=1)
+            pooled = cached[0].pooler
+        else:
+            # Batch all 77-token sections into a single forward pass. ComfyUI
+            # encodes the sections as one batch and concatenates the results
+            # along the sequence dim; the pooled output is the first
+            # section's.
+            batched_tokens: ComfyCLIPTokens = {
+                "l": [
+                    [(token, 1.0) for token in target.clip_l_tokens]
+                    for target in targets
+                ],
+            }
+            if targets[0].clip_g_tokens is not None:
+                batched_tokens["g"] = [
+                    [(token, 1.0) for token in target.clip_g_tokens]
+                    for target in targets
+                ]
+            cond, pooled = clip.encode_from_tokens(batched_tokens, return_pooled=True)
+            if encode_cache is not None:
+                section_length = cond.shape[1] // len(targets)
+                for i, target in enumerate(targets):
+                    encode_cache[target_key(target)] = EncoderOutput(
+                        cond=cond[:, i * section_length : (i + 1) * section_length],
+                        pooler=pooled if i == 0 else None,
+                    )
+
+        logger.debug("merged conds: %s, pooler: %s", cond.shape, pooled.shape)
         return [
             [
-                encoder_output.cond,
-                {"pooled_output": encoder_output.pooler},
+                cond,
+                {"pooled_output": pooled},
             ]
         ]
 
@@ -484,10 +808,14 @@ class OmostDenseDiffusionLayoutNode:
     ) -> tuple[ModelPatcher, ComfyUIConditioning]:
         """Layout conditioning"""
         work_model: ModelPatcher = model.clone()
+        encode_cache: dict[tuple, EncoderOutput] = {}
 
         for canvas_cond in canvas_conds:
             cond: ComfyUIConditioning = PromptEncoding.encode_bag_of_subprompts_greedy(
-                clip, canvas_cond["prefixes"], canvas_cond["suffixes"]
+                clip,
+                canvas_cond["prefixes"],
+                canvas_cond["suffixes"],
+                encode_cache=encode_cache,
             )
             # Set area cond
             work_model = self.dense_diffusion_add_cond_node.append(
@@ -522,9 +850,13 @@ class OmostGreedyBagsTextEmbeddingNode:
         canvas_conds: list[OmostCanvasCondition],
         clip: CLIP,
     ) -> tuple[ComfyUIConditioning]:
+        encode_cache: dict[tuple, EncoderOutput] = {}
         conds: ComfyUIConditioning = [
             PromptEncoding.encode_bag_of_subprompts_greedy(
-                clip, canvas_cond["prefixes"], canvas_cond["suffixes"]
+                clip,
+                canvas_cond["prefixes"],
+                canvas_cond["suffixes"],
+                encode_cache=encode_cache,
             )[0]
             for canvas_cond in canvas_conds
         ]
@@ -579,45 +911,67 @@ class OmostComfyLayoutNode:
         # Take the average of the two layers.
         AVERAGE = "average"
 
-    def __init__(self):
-        self.cond_set_mask_node = ConditioningSetMask()
-
     @staticmethod
     def calc_cond_mask(
         canvas_conds: list[OmostCanvasCondition],
         method: AreaOverlapMethod = AreaOverlapMethod.OVERLAY,
+        device: torch.device | None = None,
     ) -> list[OmostCanvasCondition]:
-        """Calculate canvas cond mask."""
+        """Calculate canvas cond mask.
+
+        Masks are created on `device` (default: the sampling device) so that
+        they do not need a host-to-device copy every sampling step."""
         assert len(canvas_conds) > 0
         canvas_conds = canvas_conds.copy()
+        if device is None:
+            device = comfy.model_management.get_torch_device()
 
         global_cond = canvas_conds[0]
-        global_cond["mask"] = torch.ones(
-            [CANVAS_SIZE, CANVAS_SIZE], dtype=torch.float32
-        )
         region_conds = canvas_conds[1:]
 
-        canvas_state = torch.zeros([CANVAS_SIZE, CANVAS_SIZE], dtype=torch.float32)
+        # One contiguous [N+1, 90, 90] buffer: row 0 is the global mask and
+        # row i+1 belongs to region i. Each cond holds a view into it, so all
+        # masks share a single allocation (and a single transfer if moved).
+        masks = torch.empty(
+            [len(region_conds) + 1, CANVAS_SIZE, CANVAS_SIZE],
+            dtype=torch.float32,
+            device=device,
+        )
+        masks[0] = 1.0
+        global_cond["mask"] = masks[0]
+
         if method == OmostComfyLayoutNode.AreaOverlapMethod.OVERLAY:
-            for canvas_cond in region_conds[::-1]:
+            # Single "topmost writer" map instead of per-region float
+            # accumulation. The last region in the list is the topmost layer,
+            # so it claims its pixels first.
+            owner = torch.full(
+                [CANVAS_SIZE, CANVAS_SIZE], -1, dtype=torch.int16, device=device
+            )
+            for i, canvas_cond in reversed(list(enumerate(region_conds))):
                 a, b, c, d = canvas_cond["rect"]
-                mask = torch.zeros([CANVAS_SIZE, CANVAS_SIZE], dtype=torch.float32)
-                mask[a:b, c:d] = 1.0
-                mask = mask * (1 - canvas_state)
-                canvas_state += mask
-                canvas_cond["mask"] = mask
+                sub = owner[a:b, c:d]
+                sub[sub == -1] = i
+            masks[1:] = owner.unsqueeze(0) == torch.arange(
+                len(region_conds), dtype=owner.dtype, device=device
+            ).view(-1, 1, 1)
         elif method == OmostComfyLayoutNode.AreaOverlapMethod.AVERAGE:
+            canvas_state = torch.zeros(
+                [CANVAS_SIZE, CANVAS_SIZE], dtype=torch.float32, device=device
+            )
             canvas_state += 1e-6  # Avoid division by zero
             for canvas_cond in region_conds:
                 a, b, c, d = canvas_cond["rect"]
                 canvas_state[a:b, c:d] += 1.0
 
-            for canvas_cond in region_conds:
+            for i, canvas_cond in enumerate(region_conds):
                 a, b, c, d = canvas_cond["rect"]
-                mask = torch.zeros([CANVAS_SIZE, CANVAS_SIZE], dtype=torch.float32)
+                mask = masks[i + 1]
+                mask.zero_()
                 mask[a:b, c:d] = 1.0
-                mask = mask / canvas_state
-                canvas_cond["mask"] = mask
+                mask /= canvas_state
+
+        for i, canvas_cond in enumerate(region_conds):
+            canvas_cond["mask"] = masks[i + 1]
 
         return canvas_conds
 
@@ -638,38 +992,63 @@ class OmostComfyLayoutNode:
         canvas_conds = OmostComfyLayoutNode.calc_cond_mask(
             canvas_conds, method=overlap_method
         )
+        encode_cache: dict[tuple, EncoderOutput] = {}
 
         for i, canvas_cond in enumerate(canvas_conds):
             is_global = i == 0
 
+            # Regions fully occluded by other layers have an all-zero mask
+            # and would contribute nothing; skip their CLIP encode entirely.
+            # The mask is still emitted to keep the MASK output aligned with
+            # the canvas conds.
+            if not is_global and not canvas_cond["mask"].any():
+                masks.append(canvas_cond["mask"].unsqueeze(0))
+                continue
+
             prefixes = canvas_cond["prefixes"]
             # Skip the global prefix for region prompts.
             if not is_global:
                 prefixes = prefixes[1:]
 
             cond: ComfyUIConditioning = PromptEncoding.encode_bag_of_subprompts_greedy(
-                clip, prefixes, canvas_cond["suffixes"]
+                clip,
+                prefixes,
+                canvas_cond["suffixes"],
+                encode_cache=encode_cache,
             )
-            # Set area cond
-            cond: ComfyUIConditioning = self.cond_set_mask_node.append(
-                cond,
-                mask=canvas_cond["mask"],
-                set_cond_area="default",
-                strength=global_strength if is_global else region_strength,
-            )[0]
             assert len(cond) == 1
-            positive.extend(cond)
+            # Set area cond. Build the masked conditioning entry directly
+            # (same fields ConditioningSetMask would set) instead of
+            # round-tripping through the node's per-entry copy.
+            cond_tensor, extra_dict = cond[0]
+            positive.append(
+                [
+                    cond_tensor,
+                    {
+                        **extra_dict,
+                        "mask": canvas_cond["mask"],
+                        "set_area_to_bounds": False,
+                        "mask_strength": global_strength if is_global else region_strength,
+                    },
+                ]
+            )
             masks.append(canvas_cond["mask"].unsqueeze(0))
 
         return (
             positive,
             # Output masks in case it's needed for debugging or the user might
             # want to apply extra condition such as ControlNet/IPAdapter to
-            # specified region.
-            torch.cat(masks, dim=0),
+            # specified region. Moved to the intermediate device as ComfyUI
+            # expects for node outputs.
+            torch.cat(masks, dim=0).to(comfy.model_management.intermediate_device()),
         )
 
 
+@functools.lru_cache(maxsize=32)
+def _parse_canvas_json(json_str: str) -> list[OmostCanvasCondition]:
+    return json.loads(json_str)
+
+
 class OmostLoadCanvasConditioningNode:
     @classmethod
     def INPUT_TYPES(s):
@@ -685,7 +1064,9 @@ class OmostLoadCanvasConditioningNode:
 
     def load_canvas(self, json_str: str) -> Tuple[list[OmostCanvasCondition]]:
         """Load canvas from file"""
-        return (json.loads(json_str),)
+        # Copy the cond dicts so downstream nodes (which attach masks in
+        # place) never mutate the cached parse.
+        return ([dict(cond) for cond in _parse_canvas_json(json_str)],)
 
 
 class OmostLoadCanvasPythonCodeNode:
@@ -1,4 +1,8 @@
-from ..lib_omost.greedy_encode import greedy_partition, CLIPTokens
+from ..lib_omost.greedy_encode import (
+    compose_greedy_bags,
+    greedy_partition,
+    CLIPTokens,
+)
 
 
 def test_greedy_partition():
@@ -13,3 +17,18 @@ def test_greedy_partition():
         [items[3]],
         [items[4], items[5]],
     ]
+
+
+def test_compose_greedy_bags():
+    """Each target starts with the prefix tokens and is clamped to 77."""
+    token_map = {"prefix": [1] * 5, "a": [2] * 40, "b": [3] * 40}
+    targets = compose_greedy_bags(
+        ["prefix"],
+        ["a", "b"],
+        tokenize_func=lambda text: CLIPTokens(clip_l_tokens=token_map[text]),
+    )
+    assert len(targets) == 2
+    for target, suffix_token in zip(targets, [2, 3]):
+        assert len(target.clip_l_tokens) == 77
+        assert target.clip_l_tokens[1:6] == [1] * 5
+        assert target.clip_l_tokens[6] == suffix_token